@@ -1,7 +1,11 @@
 from ortools.sat.python import cp_model
-from json import load
+from google.protobuf.message import DecodeError
+from json import JSONDecodeError, dump, dumps, load
 from collections import defaultdict
-
+from hashlib import sha256
+from pathlib import Path
+from tempfile import mkstemp
+import os
 
 with open("./inbound-trailers.json", "r") as f:
     trailer_data = load(f)
@@ -103,11 +107,6 @@ all_jobs = range(num_jobs)
 num_machines = 5  # "machine count" is set
 all_machines = range(num_machines)
 
-# flexible job shop implementation using or-tools CP solver
-# implementation generally based on cp-sat job shop implementation here
-# https://github.com/google/or-tools/tree/stable/examples/python
-model = cp_model.CpModel()
-
 # need to calculate max horizon for completion
 # this might not be totally right when accounting for
 # constraint of live unloads
@@ -122,106 +121,257 @@ for job in jobs:
 
 print("Horizon = %i" % horizon)
 
-# Global storage of variables.
-intervals_per_resources = defaultdict(list)
-starts = {}  # indexed by (job_id, task_id).
-presences = {}  # indexed by (job_id, task_id, alt_id).
-job_ends = []
 
-# Scan the trailer unload jobs and create the
-# relevant variables and intervals to control start end / durations of tasks & their alernatives
-for job_id in all_jobs:
-    job = jobs[job_id]
-    num_tasks = len(job["tasks"])
-    previous_end = None
-    for task_id in range(num_tasks):
-        task = job["tasks"][task_id]
-
-        min_duration = task[0][0]
-        max_duration = task[0][0]
-
-        num_alternatives = len(task)
-        all_alternatives = range(num_alternatives)
-
-        for alt_id in range(1, num_alternatives):
-            alt_duration = task[alt_id][0]
-            min_duration = min(min_duration, alt_duration)
-            max_duration = max(max_duration, alt_duration)
-
-        # Create main interval for the task.
-        suffix_name = "_j%i_t%i" % (job_id, task_id)
-        # If an unload has a live unload requirement
-        # set start time interval based on the live unload schedule time
-        # guarantees that the unload will be scheduled to start in the specified interval
-        if job["live_start"] > -1:
-            start = model.NewIntVar(
-                job["live_start"], job["live_end"], "start" + suffix_name
+# flexible job shop implementation using or-tools CP solver
+# implementation generally based on cp-sat job shop implementation here
+# https://github.com/google/or-tools/tree/stable/examples/python
+def build_model(jobs, horizon, num_machines):
+    """
+    builds the flexible job shop cp-sat model for a set of trailer unloads
+    returns the model with the start / presence variables needed to read the solution
+    """
+    model = cp_model.CpModel()
+
+    # Storage of variables.
+    intervals_per_resources = defaultdict(list)
+    starts = {}  # indexed by (job_id, task_id).
+    presences = {}  # indexed by (job_id, task_id, alt_id).
+    job_ends = []
+
+    # Scan the trailer unload jobs and create the
+    # relevant variables and intervals to control start end / durations of tasks & their alernatives
+    for job_id in range(len(jobs)):
+        job = jobs[job_id]
+        num_tasks = len(job["tasks"])
+        previous_end = None
+        for task_id in range(num_tasks):
+            task = job["tasks"][task_id]
+
+            min_duration = task[0][0]
+            max_duration = task[0][0]
+
+            num_alternatives = len(task)
+            all_alternatives = range(num_alternatives)
+
+            for alt_id in range(1, num_alternatives):
+                alt_duration = task[alt_id][0]
+                min_duration = min(min_duration, alt_duration)
+                max_duration = max(max_duration, alt_duration)
+
+            # Create main interval for the task.
+            suffix_name = "_j%i_t%i" % (job_id, task_id)
+            # If an unload has a live unload requirement
+            # set start time interval based on the live unload schedule time
+            # guarantees that the unload will be scheduled to start in the specified interval
+            if job["live_start"] > -1:
+                start = model.NewIntVar(
+                    job["live_start"], job["live_end"], "start" + suffix_name
+                )
+            else:
+                start = model.NewIntVar(0, horizon, "start" + suffix_name)
+            duration = model.NewIntVar(
+                min_duration, max_duration, "duration" + suffix_name
+            )
+            end = model.NewIntVar(0, horizon, "end" + suffix_name)
+            interval = model.NewIntervalVar(
+                start, duration, end, "interval" + suffix_name
             )
-        else:
-            start = model.NewIntVar(0, horizon, "start" + suffix_name)
-        duration = model.NewIntVar(min_duration, max_duration, "duration" + suffix_name)
-        end = model.NewIntVar(0, horizon, "end" + suffix_name)
-        interval = model.NewIntervalVar(start, duration, end, "interval" + suffix_name)
-
-        # Store the start for the solution.
-        starts[(job_id, task_id)] = start
-
-        # Add precedence with previous task in the same job.
-        if previous_end is not None:
-            model.Add(start >= previous_end)
-        previous_end = end
-
-        # alternative intervals.
-        if num_alternatives > 1:
-            l_presences = []
-            for alt_id in all_alternatives:
-                alt_suffix = "_j%i_t%i_a%i" % (job_id, task_id, alt_id)
-                l_presence = model.NewBoolVar("presence" + alt_suffix)
-                # If an unload has a live unload requirement
-                # set start time interval based on the live unload schedule time
-                # guarantees that the unload will be scheduled to start in the specified interval
-                if job["live_start"] > -1:
-                    l_start = model.NewIntVar(
-                        job["live_start"], job["live_end"], "start" + suffix_name
+
+            # Store the start for the solution.
+            starts[(job_id, task_id)] = start
+
+            # Add precedence with previous task in the same job.
+            if previous_end is not None:
+                model.Add(start >= previous_end)
+            previous_end = end
+
+            # alternative intervals.
+            if num_alternatives > 1:
+                l_presences = []
+                for alt_id in all_alternatives:
+                    alt_suffix = "_j%i_t%i_a%i" % (job_id, task_id, alt_id)
+                    l_presence = model.NewBoolVar("presence" + alt_suffix)
+                    # If an unload has a live unload requirement
+                    # set start time interval based on the live unload schedule time
+                    # guarantees that the unload will be scheduled to start in the specified interval
+                    if job["live_start"] > -1:
+                        l_start = model.NewIntVar(
+                            job["live_start"], job["live_end"], "start" + suffix_name
+                        )
+                    else:
+                        l_start = model.NewIntVar(0, horizon, "start" + suffix_name)
+                    l_duration = task[alt_id][0]
+                    l_end = model.NewIntVar(0, horizon, "end" + alt_suffix)
+                    l_interval = model.NewOptionalIntervalVar(
+                        l_start, l_duration, l_end, l_presence, "interval" + alt_suffix
                     )
-                else:
-                    l_start = model.NewIntVar(0, horizon, "start" + suffix_name)
-                l_duration = task[alt_id][0]
-                l_end = model.NewIntVar(0, horizon, "end" + alt_suffix)
-                l_interval = model.NewOptionalIntervalVar(
-                    l_start, l_duration, l_end, l_presence, "interval" + alt_suffix
-                )
-                l_presences.append(l_presence)
+                    l_presences.append(l_presence)
+
+                    # Link the master variables with the local ones.
+                    model.Add(start == l_start).OnlyEnforceIf(l_presence)
+                    model.Add(duration == l_duration).OnlyEnforceIf(l_presence)
+                    model.Add(end == l_end).OnlyEnforceIf(l_presence)
+
+                    # Add the local interval to the right machine.
+                    intervals_per_resources[task[alt_id][1]].append(l_interval)
+
+                    # Store the presences for the solution.
+                    presences[(job_id, task_id, alt_id)] = l_presence
+
+                # Select exactly one presence variable.
+                model.AddExactlyOne(l_presences)
+            else:
+                intervals_per_resources[task[0][1]].append(interval)
+                presences[(job_id, task_id, 0)] = model.NewConstant(1)
+
+        job_ends.append(previous_end)
+
+    # Create machines constraints.
+    for machine_id in range(num_machines):
+        intervals = intervals_per_resources[machine_id]
+        if len(intervals) > 1:
+            model.AddNoOverlap(intervals)
+
+    # Makespan objective
+    makespan = model.NewIntVar(0, horizon, "makespan")
+    model.AddMaxEquality(makespan, job_ends)
+    model.Minimize(makespan)
+
+    return model, starts, presences
+
+
+# model cache
+# building the model is a python loop over every job / task / alternative
+# when the same trailer mix is scheduled again (what-if scenarios) the compiled model
+# is reloaded from disk instead of being rebuilt
+# bump MODEL_CACHE_VERSION whenever build_model changes so stale models are not reused
+MODEL_CACHE_DIR = Path("./model-cache")
+MODEL_CACHE_VERSION = 1
 
-                # Link the master variables with the local ones.
-                model.Add(start == l_start).OnlyEnforceIf(l_presence)
-                model.Add(duration == l_duration).OnlyEnforceIf(l_presence)
-                model.Add(end == l_end).OnlyEnforceIf(l_presence)
 
-                # Add the local interval to the right machine.
-                intervals_per_resources[task[alt_id][1]].append(l_interval)
+def workload_signature(unloads, num_machines):
+    """
+    hashes the normalized unload structure (durations, eligible machines, live windows)
+    trailers that produce the same unload structure share a cached model
+    """
+    workload = {
+        "version": MODEL_CACHE_VERSION,
+        "num_machines": num_machines,
+        "unloads": [
+            {
+                "tasks": [
+                    [[int(duration), int(machine)] for duration, machine in task]
+                    for task in unload["tasks"]
+                ],
+                "live_start": int(unload["live_start"]),
+                "live_end": int(unload["live_end"]),
+            }
+            for unload in unloads
+        ],
+    }
+    return sha256(dumps(workload, sort_keys=True).encode("utf-8")).hexdigest()
 
-                # Store the presences for the solution.
-                presences[(job_id, task_id, alt_id)] = l_presence
 
-            # Select exactly one presence variable.
-            model.AddExactlyOne(l_presences)
-        else:
-            intervals_per_resources[task[0][1]].append(interval)
-            presences[(job_id, task_id, 0)] = model.NewConstant(1)
+def model_proto_suffix(model):
+    """
+    picks the on-disk format for the model proto
+    older or-tools releases expose a protobuf message that parses the binary format
+    newer releases expose a native helper that only loads the text format directly
+    """
+    return ".pb" if hasattr(model.Proto(), "ParseFromString") else ".txt"
+
+
+def replace_cache_file(signature, suffix, write):
+    """
+    writes a cache file under a temp name in the cache dir and moves it into place
+    so an interrupted or concurrent run never leaves a partially written file behind
+    """
+    fd, tmp_path = mkstemp(prefix=f"{signature}.", suffix=suffix, dir=MODEL_CACHE_DIR)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, MODEL_CACHE_DIR / f"{signature}{suffix}")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save_cached_model(signature, model, horizon, starts, presences):
+    """
+    writes the serialized CpModelProto and variable index map for a workload signature
+    the index map is written last so it only exists once the proto is complete
+    """
+    MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    def write_model_proto(path):
+        if not model.ExportToFile(path):
+            raise OSError(f"failed to export model to {path}")
+
+    replace_cache_file(signature, model_proto_suffix(model), write_model_proto)
+
+    index_map = {
+        "horizon": horizon,
+        "num_variables": len(model.Proto().variables),
+        "num_constraints": len(model.Proto().constraints),
+        "starts": [[*key, var.Index()] for key, var in starts.items()],
+        "presences": [[*key, var.Index()] for key, var in presences.items()],
+    }
+
+    def write_index_map(path):
+        with open(path, "w") as f:
+            dump(index_map, f)
+
+    replace_cache_file(signature, ".json", write_index_map)
+
+
+def load_cached_model(signature):
+    """
+    reloads a cached model and its start / presence variables for a workload signature
+    returns None if the workload isn't cached yet or the cached files can't be read
+    """
+    model = cp_model.CpModel()
+    proto_path = MODEL_CACHE_DIR / f"{signature}{model_proto_suffix(model)}"
+    index_path = MODEL_CACHE_DIR / f"{signature}.json"
+    if not (proto_path.exists() and index_path.exists()):
+        return None
+
+    try:
+        with open(index_path, "r") as f:
+            index_map = load(f)
+
+        if model_proto_suffix(model) == ".pb":
+            model.Proto().ParseFromString(proto_path.read_bytes())
+        elif not model.Proto().parse_text_format(proto_path.read_text()):
+            return None
+
+        if (
+            len(model.Proto().variables) != index_map["num_variables"]
+            or len(model.Proto().constraints) != index_map["num_constraints"]
+        ):
+            return None
+
+        starts = {
+            (job_id, task_id): model.GetIntVarFromProtoIndex(index)
+            for job_id, task_id, index in index_map["starts"]
+        }
+        presences = {
+            (job_id, task_id, alt_id): model.GetIntVarFromProtoIndex(index)
+            for job_id, task_id, alt_id, index in index_map["presences"]
+        }
+    except (OSError, DecodeError, JSONDecodeError, KeyError, ValueError, TypeError):
+        return None
 
-    job_ends.append(previous_end)
+    return model, index_map["horizon"], starts, presences
 
-# Create machines constraints.
-for machine_id in all_machines:
-    intervals = intervals_per_resources[machine_id]
-    if len(intervals) > 1:
-        model.AddNoOverlap(intervals)
 
-# Makespan objective
-makespan = model.NewIntVar(0, horizon, "makespan")
-model.AddMaxEquality(makespan, job_ends)
-model.Minimize(makespan)
+signature = workload_signature(unloads, num_machines)
+cached = load_cached_model(signature)
+if cached is not None:
+    print(f"Loaded cached model {signature[:12]}")
+    model, horizon, starts, presences = cached
+else:
+    model, starts, presences = build_model(jobs, horizon, num_machines)
+    save_cached_model(signature, model, horizon, starts, presences)
 
 
 # Solve model.